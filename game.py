@@ -31,11 +31,17 @@
 
 
 from enum import Enum, auto
-from typing import List, Dict, Tuple
-from collections import defaultdict
+from typing import List, Dict, Tuple, Any, Iterator, Optional, Union
+from collections import defaultdict, OrderedDict
+from functools import lru_cache
+from itertools import chain
+from multiprocessing import parent_process, resource_tracker, shared_memory
+from types import MappingProxyType
 
 import json
+import mmap
 import random
+import struct
 
 import logging
 
@@ -94,8 +100,278 @@ def chain_agents(agents1,agents2):
     for b in agents2:
         yield b
 
+
+#Zobrist哈希的特征类型
+_Z_AGENT_POS = 1      #(agent_id, x, y)
+_Z_COIN = 2           #(x, y)
+_Z_POWERUP = 3        #(x, y, powerup)
+_Z_HELD_POWERUP = 4   #(agent_id, powerup, 剩余回合)
+_Z_INVULNERABLE = 5   #(agent_id, 剩余回合)
+_Z_SCORE = 6          #(agent_id, score)
+_Z_REFRESH = 7        #(x, y, 道具刷新的回合)
+
+_MASK64 = (1 << 64) - 1
+
+
+def _splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+@lru_cache(maxsize=1 << 16)
+def zobrist_key(*feature: int) -> int:
+    """特征对应的64位随机数，由特征值确定性地生成，在不同进程之间保持一致"""
+    h = 0
+    for v in feature:
+        h = _splitmix64(h ^ (v & _MASK64))
+    return h
+
+
+class TranspositionTable:
+    """以Game.state_hash()为key的有界LRU缓存，可以在多次rollout之间共享"""
+
+    def __init__(self, capacity: int = 1 << 20):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int, default: Any = None) -> Any:
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: int, value: Any) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+_TERRAIN_MAGIC = b'SFTR'
+_TERRAIN_VERSION = 1
+#magic, version, width, height, reserved, 槽位数量, 传送门数量, meta长度；缓冲区中的整数一律为小端序
+_TERRAIN_HEADER = struct.Struct('<4sHHHHIII')
+_EMPTY = 0
+#所有Game共用的墙体cell，只读
+_WALL_CELL = MappingProxyType({'type': CellType.WALL})
+#当前进程通过share()创建的共享内存
+_owned_segments = set()
+
+
+class StaticTerrain:
+    """
+    地图中不随对局变化的部分：墙体、传送门、出生点、金币和道具的位置，以及map_conf和powerup_conf。
+
+    所有数据保存在一块连续的只读缓冲区中，可以放入multiprocessing.shared_memory或内存映射文件，
+    由多个worker进程共享，worker不需要再读取和解析map.json。
+
+    为了让Game中的查找保持为普通dict查找，每个进程在挂载时会从缓冲区解码一份墙体和传送门的查找表(cells)。
+    这份查找表每个进程只有一份，同一进程中的所有Game共用，不会复制到Game.map中；
+    Game.map只保存金币和道具等对局中会变化的状态。复制或pickle Game时terrain本身不会被复制。缓冲区布局:
+
+        header | 槽位 int16*3*n (x, y, CellType) | 传送门 int16*4*n (x, y, pair_x, pair_y) | 网格 uint8*w*h | meta json
+
+    使用方式:
+
+        terrain = StaticTerrain.from_map(map).share()   #主进程
+        game = Game(StaticTerrain.attach(terrain.name))  #worker进程
+        ...
+        terrain.close(); terrain.unlink()               #只有主进程可以unlink
+    """
+
+    def __init__(self, buf, shm: Optional[shared_memory.SharedMemory] = None, mm: Optional[mmap.mmap] = None):
+        self.shm = shm
+        self.mm = mm
+        self.buf = memoryview(buf).toreadonly()
+
+        magic, version, self.width, self.height, _, n_slots, n_portals, meta_len = _TERRAIN_HEADER.unpack_from(self.buf)
+        if magic != _TERRAIN_MAGIC or version != _TERRAIN_VERSION:
+            raise ValueError("not a static terrain buffer")
+
+        offset = _TERRAIN_HEADER.size
+        slots = struct.unpack_from(f'<{3 * n_slots}h', self.buf, offset)
+        offset += 6 * n_slots
+        portals = struct.unpack_from(f'<{4 * n_portals}h', self.buf, offset)
+        offset += 8 * n_portals
+        grid = bytes(self.buf[offset:offset + self.width * self.height])
+        offset += self.width * self.height
+        meta = json.loads(bytes(self.buf[offset:offset + meta_len]))
+
+        self.map_conf: Dict = meta['map_conf']
+        self.powerup_conf: Dict = meta['powerup_conf']
+        self.slots: List[Tuple[Tuple[int,int],CellType]] = [
+            ((slots[i], slots[i + 1]), CellType(slots[i + 2])) for i in range(0, len(slots), 3)
+        ]
+
+        portal_cells = {}
+        for i, name in enumerate(meta['portal_names']):
+            x, y, pair_x, pair_y = portals[4 * i:4 * i + 4]
+            portal_cells[(x, y)] = MappingProxyType({'type': CellType.PORTAL, 'pair': (pair_x, pair_y), 'name': name})
+
+        #墙体和传送门的查找表，cell都是只读的，不能修改
+        self.cells: Dict[Tuple[int,int],MappingProxyType] = {}
+        for i, code in enumerate(grid):
+            if code == _EMPTY:
+                continue
+            pos = (i % self.width, i // self.width)
+            self.cells[pos] = _WALL_CELL if code == CellType.WALL.value else portal_cells[pos]
+
+
+    @classmethod
+    def from_map(cls, map: Dict) -> 'StaticTerrain':
+        """从map.json的内容构造，只在当前进程内使用"""
+        map_conf = map['map_conf']
+        width, height = map_conf['width'], map_conf['height']
+
+        #同一位置出现多次时以最后一次为准，顺序以第一次出现为准
+        cells = {}
+        for cell in map['map']:
+            x, y = cell['x'], cell['y']
+            if not (0 <= x < width and 0 <= y < height):
+                raise ValueError(f"cell ({x},{y}) out of map bounds")
+            cells[(x, y)] = cell
+
+        grid = bytearray(width * height)
+        slots = []
+        portals = []
+        portal_names = []
+        for (x, y), cell in cells.items():
+            ty = CellType[cell['type']]
+            if ty == CellType.WALL:
+                grid[y * width + x] = ty.value
+            elif ty == CellType.PORTAL:
+                grid[y * width + x] = ty.value
+                portals.extend([x, y, cell['pair']['x'], cell['pair']['y']])
+                portal_names.append(cell['name'])
+            else:
+                slots.extend([x, y, ty.value])
+
+        meta = json.dumps({
+            'map_conf': map_conf,
+            'powerup_conf': map['powerup_conf'],
+            'portal_names': portal_names,
+        }, ensure_ascii=False).encode('utf-8')
+
+        buf = bytearray(_TERRAIN_HEADER.pack(_TERRAIN_MAGIC, _TERRAIN_VERSION, width, height, 0, len(slots) // 3, len(portal_names), len(meta)))
+        buf += struct.pack(f'<{len(slots)}h', *slots)
+        buf += struct.pack(f'<{len(portals)}h', *portals)
+        buf += grid
+        buf += meta
+        return cls(bytes(buf))
+
+
+    def share(self, name: Optional[str] = None) -> 'StaticTerrain':
+        """复制到一块新的共享内存中，调用方是这块共享内存的owner，负责close()和unlink()"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=len(self.buf))
+        _owned_segments.add(shm.name)
+        shm.buf[:len(self.buf)] = self.buf
+        return StaticTerrain(shm.buf[:len(self.buf)], shm=shm)
+
+
+    @classmethod
+    def attach(cls, name: str) -> 'StaticTerrain':
+        """
+        在worker进程中以只读方式挂载share()创建的共享内存。
+        挂载方只能close()，不能unlink()，共享内存的生命周期由owner负责。
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            #python 3.13以下没有track参数，挂载时会注册到当前进程使用的resource tracker。
+            #不是由multiprocessing启动的进程使用自己的tracker，退出时会把owner的共享内存删掉，需要取消注册；
+            #multiprocessing启动的子进程(fork或spawn)与父进程共用同一个tracker，owner自己挂载时也一样，
+            #tracker中只记录一次，取消注册会把owner的注册一起删掉，这两种情况保持不变
+            shm = shared_memory.SharedMemory(name=name)
+            if parent_process() is None and shm.name not in _owned_segments:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm.buf, shm=shm)
+
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(self.buf)
+
+
+    @classmethod
+    def load(cls, path: str) -> 'StaticTerrain':
+        """以只读内存映射方式加载save()写出的文件，多个进程映射同一文件时共享物理内存"""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mm, mm=mm)
+
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.shm.name if self.shm is not None else None
+
+
+    def iter_slots(self) -> Iterator[Tuple[Tuple[int,int],CellType]]:
+        """按地图文件中的顺序遍历金币、道具和出生点的位置"""
+        return iter(self.slots)
+
+
+    def close(self) -> None:
+        """释放对缓冲区的引用；已经解码的cells仍然可用"""
+        self.buf.release()
+        if self.shm is not None:
+            self.shm.close()
+        if self.mm is not None:
+            self.mm.close()
+
+
+    def unlink(self) -> None:
+        """删除共享内存，只有share()的调用方(owner)可以调用"""
+        if self.shm is not None:
+            self.shm.unlink()
+            _owned_segments.discard(self.shm.name)
+
+
+    def __reduce__(self):
+        #共享内存按名称序列化，接收方重新挂载；其他情况按缓冲区内容序列化
+        if self.shm is not None:
+            return (StaticTerrain.attach, (self.shm.name,))
+        return (StaticTerrain, (bytes(self.buf),))
+
+
+    def __copy__(self):
+        return self
+
+
+    def __deepcopy__(self, memo):
+        #只读数据，复制出来的Game共用同一个terrain
+        return self
+
+
+    def __del__(self):
+        #先释放对缓冲区的引用，否则SharedMemory/mmap被回收时无法关闭
+        buf = getattr(self, 'buf', None)
+        if buf is not None:
+            buf.release()
+
+
 class Game:
-    def __init__(self, map: Dict):
+    def __init__(self, map: Union[Dict, StaticTerrain], track_hash: bool = False):
         # map的内容格式如下:
         # {
         #   "map_conf": {
@@ -130,10 +406,11 @@ class Game:
         #     {"x":0,"y":3,"type": "DEFENDER"},
         #   ]
         # }
-        self.map_template = self._load_map(map['map'])
-        self.map_conf = map['map_conf']
-        self.powerup_conf = map['powerup_conf']
-        self.map: Dict[Tuple[int,int],Dict] = {} #地图状态信息
+        # 也可以传入StaticTerrain，多个进程共享同一份静态地形
+        self.terrain = map if isinstance(map, StaticTerrain) else StaticTerrain.from_map(map)
+        self.map_conf = self.terrain.map_conf
+        self.powerup_conf = self.terrain.powerup_conf
+        self.map: Dict[Tuple[int,int],Dict] = {} #地图状态信息，只包含金币和道具，墙体和传送门见self.terrain.cells
         self.agents: Dict[str, Agent] = {}
         self.steps = 0
         self.rand = None
@@ -142,26 +419,10 @@ class Game:
         self.attacker = None
         self.defender = None
         self.logs = []
+        self.captures = 0 #本回合发生的抓捕次数
         self.to_refresh = defaultdict(list)
-
-
-    def _load_map(self, map_data: Dict) -> Tuple[Dict[Tuple[int, int], str],Dict,Dict]:
-        map_template = {}
-        for cell in map_data:
-            x = cell['x']
-            y = cell['y']
-            cell_type = cell['type']
-            o = {"type": CellType[cell_type]}
-            
-            if cell_type == 'PORTAL':
-                pair_x = cell['pair']['x']
-                pair_y = cell['pair']['y']
-                o['pair'] = (pair_x,pair_y)
-                o['name'] = cell['name']
-
-            map_template[(x, y)] = o
-
-        return map_template
+        self.track_hash = track_hash #为True时在apply_actions中增量维护局面哈希
+        self.zobrist_hash = 0
 
 
     def reset(self, attacker: str, defender: str, seed=0):
@@ -178,13 +439,13 @@ class Game:
         self.attacker_time_used = 0
         self.defender_time_used = 0
         self.logs = []
+        self.captures = 0
         self.to_refresh = defaultdict(list)
 
         agent_id = 0
         
 
-        for pos, obj in self.map_template.items():
-            ty = obj['type']
+        for pos, ty in self.terrain.iter_slots():
             if ty == CellType.POWERUP:
                 # 随机选择一个powerup
                 powerup = self.rand.choice(list(Powerup))
@@ -203,8 +464,7 @@ class Game:
                 self.agents[agent_id] = defender_agent
                 agent_id += 1
 
-            else:
-                self.map[pos] = obj    
+        self.zobrist_hash = self._compute_state_hash() if self.track_hash else 0
 
 
     def _check_out_of_bounds(self, agent: Agent) -> bool:
@@ -226,41 +486,52 @@ class Game:
         powerup_type = cell['powerup']
         if agent.role == agent.DEFENDER and powerup_type == Powerup.INVISIBILITY:
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得隐身道具")
-            agent.powerups["invisibility"] = self.powerup_conf['invisibility']['duration']
+            self._grant_powerup(agent, "invisibility")
 
         elif agent.role == agent.DEFENDER and powerup_type == Powerup.SHIELD:
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得防守道具")
-            agent.powerups["shield"] = self.powerup_conf['shield']['duration']
+            self._grant_powerup(agent, "shield")
 
         elif agent.role == agent.ATTACKER and powerup_type == Powerup.SWORD:
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得攻击道具")
-            agent.powerups["sword"] = self.powerup_conf['sword']['duration']
+            self._grant_powerup(agent, "sword")
 
         elif powerup_type == Powerup.PASSWALL:
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得穿墙道具")
-            agent.powerups["passwall"] = self.powerup_conf['passwall']['duration']
+            self._grant_powerup(agent, "passwall")
 
         elif powerup_type == Powerup.EXTRAVISION:
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得视野扩展道具")
             agent.vision_range = self.powerup_conf['extravision']['extra']
-            agent.powerups["extravision"] = self.powerup_conf['extravision']['duration']
+            self._grant_powerup(agent, "extravision")
 
         else:
             return
 
         del self.map[agent.next_pos]
+        self._zobrist_toggle(_Z_POWERUP, *agent.next_pos, powerup_type.value)
         refresh_interval = self.map_conf.get('refresh_interval',0)
         if refresh_interval > 0:
             self.to_refresh[self.steps+refresh_interval].append(agent.next_pos)
+            self._zobrist_toggle(_Z_REFRESH, *agent.next_pos, self.steps+refresh_interval)
+
+
+    def _grant_powerup(self, agent: Agent, name: str) -> None:
+        old = agent.powerups.get(name)
+        if old:
+            self._zobrist_toggle(_Z_HELD_POWERUP, agent.id, Powerup[name.upper()].value, old)
+        agent.powerups[name] = self.powerup_conf[name]['duration']
+        self._zobrist_toggle(_Z_HELD_POWERUP, agent.id, Powerup[name.upper()].value, agent.powerups[name])
 
 
     def _handle_coin(self, agent: Agent, cell: Dict) -> None:
         #处理获得金币的逻辑
         if agent.role != Agent.ATTACKER:
-            agent.score += self.map_conf['coin_score']  # 加分逻辑
+            self._set_score(agent, agent.score + self.map_conf['coin_score'])  # 加分逻辑
             self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]获得金币")
             # 删除地图上的这个金币
             del self.map[agent.next_pos]
+            self._zobrist_toggle(_Z_COIN, *agent.next_pos)
 
 
     # def _find_spawn_pos(self, agent):
@@ -284,17 +555,18 @@ class Game:
         if attacker.powerups.get("sword"):
             # 攻击方获得防守方的分数的一半
             score_delta = defender.score + self.map_conf['catch_score']
-            attacker.score += score_delta
-            defender.score = 0
+            self._set_score(attacker, attacker.score + score_delta)
+            self._set_score(defender, 0)
         else:
             score_delta = defender.score // 2 + self.map_conf['catch_score']
-            attacker.score += score_delta
-            defender.score //= 2
+            self._set_score(attacker, attacker.score + score_delta)
+            self._set_score(defender, defender.score // 2)
 
         #回到起始地点
         self.logs.append(f"player[{attacker.player_id}]的agent[{attacker.id}]抓获player[{defender.player_id}]的agent[{defender.id}],获得了{score_delta}金币")
         defender.next_pos = defender.origin_pos
-        defender.invulnerability_duration = self.map_conf['invulnerability_duration']
+        self._set_invulnerability(defender, self.map_conf['invulnerability_duration'])
+        self.captures += 1
 
 
     # def _handle_agent_collision_different_team(self, collision_type:str,attacker: Agent,defender: Agent):
@@ -353,10 +625,13 @@ class Game:
             # 随机选择一个powerup
             powerup = self.rand.choice(list(Powerup))
             self.map[pos] = {'type': CellType.POWERUP, 'powerup': powerup}
+            self._zobrist_toggle(_Z_REFRESH, *pos, self.steps)
+            self._zobrist_toggle(_Z_POWERUP, *pos, powerup.value)
 
 
     def apply_actions(self,attacker_actions: Dict[int, str],defender_actions: Dict[int, str],attacker_time_used = 0,defender_time_used = 0) -> None:
         self.logs = []
+        self.captures = 0
         self.steps += 1
         self.attacker_time_used += attacker_time_used
         self.defender_time_used += defender_time_used
@@ -368,7 +643,7 @@ class Game:
         for agent in self.agents.values():
             self._reduce_powerup_duration(agent)
             if agent.invulnerability_duration > 0:
-                agent.invulnerability_duration -= 1
+                self._set_invulnerability(agent, agent.invulnerability_duration - 1)
 
         attacker_agents = self._get_agents(Agent.ATTACKER)
         defender_agents = self._get_agents(Agent.DEFENDER)
@@ -390,7 +665,7 @@ class Game:
                 self.logs.append(f"player[{agent.player_id}]的agent[{agent.id}]尝试越界")
                 agent.next_pos = agent.pos
 
-            cell = self.map.get(agent.next_pos)
+            cell = self.terrain.cells.get(agent.next_pos)
             if not cell:
                 continue
 
@@ -441,17 +716,78 @@ class Game:
 
         #最后更新所有agent的pos
         for agent in chain_agents(defender_agents,attacker_agents):
+            if self.track_hash and agent.pos != agent.next_pos:
+                self._zobrist_toggle(_Z_AGENT_POS, agent.id, *agent.pos)
+                self._zobrist_toggle(_Z_AGENT_POS, agent.id, *agent.next_pos)
             agent.pos = agent.next_pos
 
 
 
     def _reduce_powerup_duration(self, agent: Agent) -> None:
         for powerup in list(agent.powerups):
+            if self.track_hash:
+                key = Powerup[powerup.upper()].value
+                self._zobrist_toggle(_Z_HELD_POWERUP, agent.id, key, agent.powerups[powerup])
             agent.powerups[powerup] -= 1
             if agent.powerups[powerup] <= 0:
                 if powerup == 'extravision':
                     agent.vision_range = self.map_conf['vision_range']
                 del agent.powerups[powerup]
+            elif self.track_hash:
+                self._zobrist_toggle(_Z_HELD_POWERUP, agent.id, key, agent.powerups[powerup])
+
+
+    def _set_score(self, agent: Agent, score: int) -> None:
+        self._zobrist_toggle(_Z_SCORE, agent.id, agent.score)
+        agent.score = score
+        self._zobrist_toggle(_Z_SCORE, agent.id, agent.score)
+
+
+    def _set_invulnerability(self, agent: Agent, duration: int) -> None:
+        if agent.invulnerability_duration > 0:
+            self._zobrist_toggle(_Z_INVULNERABLE, agent.id, agent.invulnerability_duration)
+        agent.invulnerability_duration = duration
+        if duration > 0:
+            self._zobrist_toggle(_Z_INVULNERABLE, agent.id, duration)
+
+
+    def _zobrist_toggle(self, *feature: int) -> None:
+        if self.track_hash:
+            self.zobrist_hash ^= zobrist_key(*feature)
+
+
+    def _compute_state_hash(self) -> int:
+        #从头计算局面哈希，reset时使用，也可用于校验增量结果
+        h = 0
+        for agent in self.agents.values():
+            h ^= zobrist_key(_Z_AGENT_POS, agent.id, *agent.pos)
+            h ^= zobrist_key(_Z_SCORE, agent.id, agent.score)
+            if agent.invulnerability_duration > 0:
+                h ^= zobrist_key(_Z_INVULNERABLE, agent.id, agent.invulnerability_duration)
+            for powerup, duration in agent.powerups.items():
+                h ^= zobrist_key(_Z_HELD_POWERUP, agent.id, Powerup[powerup.upper()].value, duration)
+
+        for (x, y), cell in self.map.items():
+            if cell['type'] == CellType.COIN:
+                h ^= zobrist_key(_Z_COIN, x, y)
+            elif cell['type'] == CellType.POWERUP:
+                h ^= zobrist_key(_Z_POWERUP, x, y, cell['powerup'].value)
+
+        for due, positions in self.to_refresh.items():
+            for x, y in positions:
+                h ^= zobrist_key(_Z_REFRESH, x, y, due)
+        return h
+
+
+    def state_hash(self) -> int:
+        """
+        当前局面的64位Zobrist哈希，覆盖agent位置、分数、持有道具及剩余回合、无敌回合、
+        地图上剩余的金币和道具以及道具刷新的回合，可以作为TranspositionTable的key。
+        Game(map, track_hash=True)时在apply_actions中增量更新；否则每次调用都从头计算。
+        """
+        if not self.track_hash:
+            return self._compute_state_hash()
+        return self.zobrist_hash
 
 
     def get_result(self) -> Dict:
@@ -503,6 +839,7 @@ class Game:
             agent_states[pos].append(state)
 
         views = {}
+        terrain_cells = self.terrain.cells
 
         for agent in self.agents.values():
 
@@ -524,7 +861,7 @@ class Game:
                     vx,vy = x+dx, y+dy
 
                     #find in map
-                    cell = self.map.get((vx,vy))
+                    cell = self.map.get((vx,vy)) or terrain_cells.get((vx,vy))
                     if cell is not None:
                         if cell['type'] == CellType.COIN:
                             view['coins'].append({
@@ -574,6 +911,10 @@ class Game:
     def get_logs(self):
         return self.logs
 
+    def coins_remaining(self) -> int:
+        """地图上剩余的金币数量"""
+        return sum(1 for cell in self.map.values() if cell['type'] == CellType.COIN)
+
     def is_over(self) -> bool:
         """检查游戏是否结束"""
         # 判断是否达到最大回合数
@@ -639,7 +980,7 @@ class Game:
             "coins": []
         }
         
-        for pos, cell in self.map.items():
+        for pos, cell in chain(self.terrain.cells.items(), self.map.items()):
             if cell['type'] == CellType.WALL:
                 map_state["walls"].append({"x": pos[0], "y": pos[1]})
             elif cell['type'] == CellType.PORTAL:
@@ -0,0 +1,253 @@
+"""
+流式记录比赛结果与逐回合指标
+
+大规模对战扫描时不再把所有get_result()和日志保存在内存中，而是按固定大小的分块追加写入磁盘，
+内存占用与扫描规模无关。文件为JSON Lines格式，每一行是一个按列存储的分块:
+
+    {"rows": 2, "columns": {"game_id": [0, 1], "attacker_score": [12, 30], ...}}
+
+使用方式:
+
+    sink = result_sink("results.jsonl", step_path="steps.jsonl")
+    for seed in seeds:
+        game.reset(attacker="a", defender="b", seed=seed)
+        while not game.is_over():
+            game.apply_actions(attacker_actions, defender_actions)
+            sink.send(game)  #每回合提交一次，对局结束时自动写入结果
+    sink.close()
+
+    print(aggregate_results("results.jsonl"))
+"""
+
+import json
+import os
+from collections import Counter, defaultdict
+from typing import Dict, Generator, Iterator, List, Optional
+
+from game import Agent, Game
+
+
+RESULT_COLUMNS = [
+    "game_id",
+    "attacker",
+    "defender",
+    "attacker_score",
+    "defender_score",
+    "attacker_time_used",
+    "defender_time_used",
+    "steps",
+]
+
+STEP_COLUMNS = [
+    "game_id",
+    "step",
+    "attacker_score_delta",
+    "defender_score_delta",
+    "captures",
+    "coins_remaining",
+]
+
+
+class ChunkWriter:
+    """把行数据缓存为列，每满chunk_size行追加一个分块到文件。默认覆盖已有文件，append=True时在末尾追加"""
+
+    def __init__(self, path: str, columns: List[str], chunk_size: int = 4096, append: bool = False):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.buffer: Dict[str, list] = {c: [] for c in columns}
+        self.f = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, row: Dict) -> None:
+        for c in self.columns:
+            self.buffer[c].append(row[c])
+        self.rows += 1
+        if self.rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.rows == 0:
+            return
+        self.f.write(json.dumps({"rows": self.rows, "columns": self.buffer}, ensure_ascii=False))
+        self.f.write("\n")
+        self.f.flush()
+        self.buffer = {c: [] for c in self.columns}
+        self.rows = 0
+
+    def close(self) -> None:
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _role_scores(game: Game) -> Dict[str, int]:
+    #按角色而不是按player_id汇总，自我对战时get_result()中两个角色的分数都是合计值
+    scores = {Agent.ATTACKER: 0, Agent.DEFENDER: 0}
+    for agent in game.agents.values():
+        scores[agent.role] += agent.score
+    return scores
+
+
+def result_row(game: Game, game_id: int) -> Dict:
+    scores = _role_scores(game)
+    return {
+        "game_id": game_id,
+        "attacker": game.attacker,
+        "defender": game.defender,
+        "attacker_score": scores[Agent.ATTACKER],
+        "defender_score": scores[Agent.DEFENDER],
+        "attacker_time_used": game.attacker_time_used,
+        "defender_time_used": game.defender_time_used,
+        "steps": game.steps,
+    }
+
+
+def result_sink(path: str, step_path: Optional[str] = None, chunk_size: int = 4096, append: bool = False) -> Generator[None, Game, None]:
+    """
+    返回一个已启动的生成器，每次apply_actions之后send(game)。
+    给定step_path时记录逐回合指标(分数变化、抓捕次数、剩余金币)；
+    game.is_over()时写入一行对局结果并开始计下一局。如果一局没有结束就reset()了(超时、出错等)，
+    收到的game.steps不再增加，这一局不写结果，之后的回合记为新的一局。close()时写入剩余的分块。
+    默认覆盖已有文件；append=True时追加到已有文件之后，game_id接着文件中最大的game_id继续编号。
+    """
+    sink = _result_sink(path, step_path, chunk_size, append)
+    next(sink)
+    return sink
+
+
+def _next_game_id(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    return max((max(columns["game_id"]) + 1 for columns in iter_chunks(path) if columns["game_id"]), default=0)
+
+
+def _result_sink(path: str, step_path: Optional[str], chunk_size: int, append: bool) -> Generator[None, Game, None]:
+    game_id = _next_game_id(path) if append else 0
+    results = ChunkWriter(path, RESULT_COLUMNS, chunk_size, append)
+    steps = ChunkWriter(step_path, STEP_COLUMNS, chunk_size, append) if step_path else None
+    last_scores = {Agent.ATTACKER: 0, Agent.DEFENDER: 0}
+    last_step = None #当前这一局最后收到的回合，None表示还没有开始
+    try:
+        while True:
+            game = yield
+            if last_step is not None and game.steps <= last_step:
+                #上一局被中途放弃
+                game_id += 1
+                last_scores = {Agent.ATTACKER: 0, Agent.DEFENDER: 0}
+            last_step = game.steps
+
+            if steps is not None:
+                scores = _role_scores(game)
+                steps.write({
+                    "game_id": game_id,
+                    "step": game.steps,
+                    "attacker_score_delta": scores[Agent.ATTACKER] - last_scores[Agent.ATTACKER],
+                    "defender_score_delta": scores[Agent.DEFENDER] - last_scores[Agent.DEFENDER],
+                    "captures": game.captures,
+                    "coins_remaining": game.coins_remaining(),
+                })
+                last_scores = scores
+
+            if game.is_over():
+                results.write(result_row(game, game_id))
+                game_id += 1
+                last_scores = {Agent.ATTACKER: 0, Agent.DEFENDER: 0}
+                last_step = None
+    finally:
+        results.close()
+        if steps is not None:
+            steps.close()
+
+
+def iter_chunks(path: str) -> Iterator[Dict[str, list]]:
+    """逐个读取分块，每次只有一个分块在内存中"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)["columns"]
+
+
+def iter_rows(path: str) -> Iterator[Dict]:
+    for columns in iter_chunks(path):
+        names = list(columns)
+        for values in zip(*(columns[n] for n in names)):
+            yield dict(zip(names, values))
+
+
+def aggregate_results(path: str, bucket_size: int = 10) -> Dict:
+    """
+    单次遍历结果文件，统计每个player和每个角色的胜率以及分数分布。
+    分数分布按bucket_size分桶，key为桶的下界。
+    攻守双方是同一个player的对局(自我对战)只计入games、draws和角色统计，不计入player统计，数量记在self_play中。
+    """
+    games = 0
+    draws = 0
+    self_play = 0
+    player_games = Counter()
+    player_wins = Counter()
+    player_score_sum = Counter()
+    player_scores = defaultdict(Counter)
+    role_wins = Counter()
+    role_scores = defaultdict(Counter)
+
+    for row in iter_rows(path):
+        games += 1
+        a, d = row["attacker"], row["defender"]
+        a_score, d_score = row["attacker_score"], row["defender_score"]
+        is_self_play = a == d
+        if is_self_play:
+            self_play += 1
+
+        for player, role, score in [(a, "ATTACKER", a_score), (d, "DEFENDER", d_score)]:
+            bucket = score // bucket_size * bucket_size
+            role_scores[role][bucket] += 1
+            if not is_self_play:
+                player_games[player] += 1
+                player_score_sum[player] += score
+                player_scores[player][bucket] += 1
+
+        if a_score > d_score:
+            if not is_self_play:
+                player_wins[a] += 1
+            role_wins["ATTACKER"] += 1
+        elif d_score > a_score:
+            if not is_self_play:
+                player_wins[d] += 1
+            role_wins["DEFENDER"] += 1
+        else:
+            draws += 1
+
+    return {
+        "games": games,
+        "draws": draws,
+        "self_play": self_play,
+        "players": {
+            player: {
+                "games": n,
+                "wins": player_wins[player],
+                "win_rate": player_wins[player] / n,
+                "mean_score": player_score_sum[player] / n,
+                "score_distribution": dict(sorted(player_scores[player].items())),
+            }
+            for player, n in player_games.items()
+        },
+        "roles": {
+            role: {
+                "wins": role_wins[role],
+                "win_rate": role_wins[role] / games if games else 0.0,
+                "score_distribution": dict(sorted(role_scores[role].items())),
+            }
+            for role in ["ATTACKER", "DEFENDER"]
+        },
+    }